@@ -1,14 +1,16 @@
 import time
 from datetime import datetime, date
 
-import altair as alt
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 import gspread
 from google.oauth2.service_account import Credentials
-from gspread_dataframe import get_as_dataframe, set_with_dataframe
-from gspread.exceptions import SpreadsheetNotFound, APIError
+from requests.adapters import HTTPAdapter
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from urllib3.util.retry import Retry
+from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound, APIError
 
 # ========================== APP CONFIG ==========================
 st.set_page_config(page_title="Church Attendance", layout="wide")
@@ -23,9 +25,77 @@ ABSENCES_WS   = "absences"
 ABSENCE_COLS  = ["Timestamp", "ServiceDate", "ServiceName", "Attendee", "Note"]
 
 ATTENDANCE_COLS = ["Timestamp", "ServiceDate", "ServiceName", "Attendee", "Household", "Notes"]
+ARROW_TEXT_COLS = ["Timestamp", "Attendee", "Notes"]
 MEMBER_COLS     = ["FirstName", "LastName", "Attendee", "Notes", "Active"]  # Active: 1/0
 
+# ServiceDate is held as datetime64 in memory; show it without the time part
+DATE_COLUMN_CONFIG = {"ServiceDate": st.column_config.DateColumn("ServiceDate", format="YYYY-MM-DD")}
+
+# Plain Vega-Lite specs without transforms: dashboard_aggregates() already reduced the data
+_ZOOM = [{"name": "zoom", "select": "interval", "bind": "scales"}]
+
+DAILY_SPEC = {
+    "height": 320,
+    "encoding": {"x": {"field": "Date", "type": "temporal"}},
+    "layer": [
+        {
+            "mark": {"type": "line", "clip": True},
+            "params": _ZOOM,
+            "encoding": {
+                "y": {"field": "people", "type": "quantitative", "title": "People"},
+                "tooltip": [{"field": "Date", "type": "temporal"}, {"field": "people", "type": "quantitative"}],
+            },
+        },
+        {
+            "mark": {"type": "line", "strokeDash": [6, 3], "clip": True},
+            "encoding": {
+                "y": {"field": "roll", "type": "quantitative"},
+                "tooltip": [{"field": "Date", "type": "temporal"}, {"field": "roll", "type": "quantitative"}],
+            },
+        },
+    ],
+}
+
+SVC_MIX_SPEC = {
+    "height": 260,
+    "mark": {"type": "area", "clip": True},
+    "params": _ZOOM,
+    "encoding": {
+        "x": {"field": "Date", "type": "temporal"},
+        "y": {"field": "people", "type": "quantitative"},
+        "color": {"field": "ServiceName", "type": "nominal"},
+        "tooltip": [
+            {"field": "Date", "type": "temporal"},
+            {"field": "ServiceName", "type": "nominal"},
+            {"field": "people", "type": "quantitative"},
+        ],
+    },
+}
+
+TOPN_SPEC = {
+    "mark": "bar",
+    "encoding": {
+        "x": {"field": "people", "type": "quantitative", "title": "People (incl. household)"},
+        "y": {"field": "Attendee", "type": "nominal", "sort": "-x", "title": None},
+        "tooltip": [
+            {"field": "Attendee", "type": "nominal"},
+            {"field": "times", "type": "quantitative"},
+            {"field": "people", "type": "quantitative"},
+        ],
+    },
+}
+
 # ==================== GOOGLE SHEETS HELPERS =====================
+def _sheets_status(e: BaseException) -> int | None:
+    return e.response.status_code if isinstance(e, APIError) else None
+
+# 429s are never applied, so any call may retry them; 5xx only where a repeat is harmless
+_BACKOFF = dict(wait=wait_exponential_jitter(initial=0.5, max=10), stop=stop_after_attempt(5), reraise=True)
+retry_rate_limited = retry(retry=retry_if_exception(lambda e: _sheets_status(e) == 429), **_BACKOFF)
+retry_transient = retry(
+    retry=retry_if_exception(lambda e: _sheets_status(e) in (429, 500, 502, 503, 504)), **_BACKOFF
+)
+
 @st.cache_resource(show_spinner=False)
 def get_gspread_client() -> gspread.Client:
     # Make the private key robust to either real newlines or literal "\n"
@@ -41,133 +111,433 @@ def get_gspread_client() -> gspread.Client:
             "https://www.googleapis.com/auth/drive",
         ],
     )
-    return gspread.authorize(creds)
+    gc = gspread.authorize(creds)
+    # Pooled keep-alive session; retries dropped connections only (statuses retry above)
+    http_retry = Retry(total=5, backoff_factor=0.5)
+    gc.http_client.session.mount(
+        "https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=http_retry)
+    )
+    return gc
 
 def open_or_create_spreadsheet(gc: gspread.Client):
     """Open the spreadsheet by title; create if missing (Drive API must be enabled)."""
     try:
         return gc.open(SHEET_NAME)
-    except (SpreadsheetNotFound, APIError):
+    except SpreadsheetNotFound:  # other APIErrors (429/5xx) raise rather than create a new sheet
         return gc.create(SHEET_NAME)
 
 def open_or_create_ws(sh, title: str, header: list[str]):
     """Open a worksheet or create it with headers."""
     try:
         ws = sh.worksheet(title)
-    except Exception:
+    except WorksheetNotFound:
         ws = sh.add_worksheet(title=title, rows=3000, cols=max(8, len(header)))
         ws.update([header])
     return ws
 
+@st.cache_resource(show_spinner=False)
+@retry_transient  # failures raise out of the retry and are never cached
+def get_ws(title: str, header: tuple[str, ...]):
+    """Worksheet handle, opened once per process (header is a tuple so it hashes)."""
+    gc = get_gspread_client()
+    sh = open_or_create_spreadsheet(gc)
+    return open_or_create_ws(sh, title, list(header))
+
+def write_ws(ws, df: pd.DataFrame) -> None:
+    """Replace a tab with df (header + rows) in one values.update; blanks for missing cells."""
+    body = [df.columns.tolist()] + df.astype(object).where(df.notna(), "").values.tolist()
+    ws.clear()
+    ws.update(values=body, range_name="A1", value_input_option="USER_ENTERED")
+
+def values_frame(rows: list[list[str]]) -> pd.DataFrame:
+    """Tab values as a frame of display strings, first row as header; blank cells are NaN."""
+    if not rows:
+        return pd.DataFrame()
+    header = rows[0]
+    # Skip blank (scratch) and duplicate headers; duplicates would break ensure_*_cols' reindex
+    keep = [i for i, h in enumerate(header) if h.strip() and h not in header[:i]]
+    df = pd.DataFrame(rows[1:], columns=range(len(header))).iloc[:, keep]
+    df.columns = [header[i] for i in keep]
+    return df.replace("", np.nan)
+
+def parse_sheet_dates(values: pd.Series) -> tuple[pd.Series, list]:
+    """Sheet date text as datetime64, plus the index of values a rewrite would blank or alter.
+
+    Those are text that isn't a date and non-ISO dates whose day and month could
+    swap (03/01/2024); format="mixed" picks an order per value, so they're counted.
+    """
+    raw = values.astype("string").str.strip().replace("", pd.NA)
+    parsed = pd.to_datetime(raw, format="mixed", errors="coerce")
+    parts = raw.str.extract(r"^(\d{1,2})\D(\d{1,2})\D").apply(pd.to_numeric)
+    ambiguous = (parts[0] <= 12) & (parts[1] <= 12) & (parts[0] != parts[1])
+    return parsed, raw.index[(parsed.isna() & raw.notna()) | ambiguous].tolist()
+
 def ensure_attendance_cols(df: pd.DataFrame) -> pd.DataFrame:
-    if df is None or df.empty:
-        df = pd.DataFrame(columns=ATTENDANCE_COLS)
-    for c in ATTENDANCE_COLS:
-        if c not in df.columns:
-            df[c] = "" if c != "Household" else 1
-    df = df[ATTENDANCE_COLS].copy()
-    df["Household"] = pd.to_numeric(df["Household"], errors="coerce").fillna(1).astype(int)
-    df["ServiceDate"] = df["ServiceDate"].astype(str)
+    # One reindex adds any missing columns as blanks (Household then defaults to 1)
+    df = (pd.DataFrame() if df is None else df).reindex(columns=ATTENDANCE_COLS, fill_value="")
+    if not pd.api.types.is_integer_dtype(df["Household"]):  # already int when re-serializing
+        df["Household"] = pd.to_numeric(df["Household"], errors="coerce").fillna(1).astype(int)
+    # Parsed once here; only written back as ISO text by serialize_attendance()
+    if not pd.api.types.is_datetime64_any_dtype(df["ServiceDate"]):
+        df["ServiceDate"], df.attrs["unparsed_dates"] = parse_sheet_dates(df["ServiceDate"])
+    df["ServiceDate"] = df["ServiceDate"].dt.normalize()
+    # Few distinct services: group/filter on category codes (groupbys pass observed=True)
+    df["ServiceName"] = df["ServiceName"].astype("category")
+    # Free text: Arrow-backed strings (compact, pyarrow kernels for compares/contains)
+    df[ARROW_TEXT_COLS] = df[ARROW_TEXT_COLS].astype("string[pyarrow]")
     return df
 
+def serialize_attendance(df: pd.DataFrame) -> pd.DataFrame:
+    """Attendance as written to the sheet / CSV, with ServiceDate as YYYY-MM-DD text."""
+    out = ensure_attendance_cols(df)
+    out["ServiceDate"] = out["ServiceDate"].dt.strftime("%Y-%m-%d")
+    return out.astype(object).where(out.notna(), "")  # blanks, not NaN/<NA>, go to the API
+
 def ensure_member_cols(df: pd.DataFrame) -> pd.DataFrame:
-    if df is None or df.empty:
-        df = pd.DataFrame(columns=MEMBER_COLS)
-    for c in MEMBER_COLS:
-        if c not in df.columns:
-            df[c] = "" if c not in ("Active",) else 1
-    # Compose Attendee consistently
-    df["FirstName"] = df["FirstName"].fillna("").astype(str).str.strip()
-    df["LastName"]  = df["LastName"].fillna("").astype(str).str.strip()
-    df["Attendee"]  = (df["FirstName"] + " " + df["LastName"]).str.strip()
-    df["Active"]    = pd.to_numeric(df["Active"], errors="coerce").fillna(1).astype(int)
-    df = df[MEMBER_COLS].copy()
+    df = (pd.DataFrame() if df is None else df).reindex(columns=MEMBER_COLS, fill_value="")  # blank Active -> 1
+    # Compose Attendee consistently (Arrow-backed strings for the name columns)
+    first = df["FirstName"].astype("string[pyarrow]").fillna("").str.strip()
+    last  = df["LastName"].astype("string[pyarrow]").fillna("").str.strip()
+    df["FirstName"] = first
+    df["LastName"]  = last
+    df["Attendee"]  = (first + " " + last).str.strip()
+    df["Active"]    = pd.to_numeric(df["Active"], errors="coerce").fillna(1).astype("int32")
     return df
 
-@st.cache_data(ttl=10, show_spinner=False)
-def load_attendance() -> pd.DataFrame:
-    gc = get_gspread_client()
-    sh = open_or_create_spreadsheet(gc)
-    ws = open_or_create_ws(sh, ATTENDANCE_WS, ATTENDANCE_COLS)
-    df = get_as_dataframe(ws, evaluate_formulas=True, header=0, dtype=str)
-    if df is None or df.empty or df.columns.tolist()[:1] != ["Timestamp"]:
+def attendance_frame(rows: list[list[str]]) -> pd.DataFrame:
+    df = values_frame(rows)
+    if df is None or df.empty or "Timestamp" not in df.columns:
         df = pd.DataFrame(columns=ATTENDANCE_COLS)
-    df = df.dropna(how="all")
-    return ensure_attendance_cols(df)
+    df = ensure_attendance_cols(df.dropna(how="all"))
+    # Row writes address cells by column position, which needs the sheet in this order
+    df.attrs["positional_ok"] = bool(rows) and rows[0][:len(ATTENDANCE_COLS)] == ATTENDANCE_COLS
+    return df
 
-@st.cache_data(ttl=30, show_spinner=False)
-def load_members() -> pd.DataFrame:
-    gc = get_gspread_client()
-    sh = open_or_create_spreadsheet(gc)
-    ws = open_or_create_ws(sh, MEMBERS_WS, MEMBER_COLS)
-    df = get_as_dataframe(ws, evaluate_formulas=True, header=0, dtype=str)
+def members_frame(rows: list[list[str]]) -> pd.DataFrame:
+    df = values_frame(rows)
     if df is None or df.empty or ("FirstName" not in df.columns and "Attendee" not in df.columns):
         df = pd.DataFrame(columns=MEMBER_COLS)
     df = df.dropna(how="all")
     return ensure_member_cols(df)
 
+@retry_transient
 def save_attendance(df: pd.DataFrame) -> None:
-    gc = get_gspread_client()
-    sh = open_or_create_spreadsheet(gc)
-    ws = open_or_create_ws(sh, ATTENDANCE_WS, ATTENDANCE_COLS)
-    clean = ensure_attendance_cols(df)
-    ws.clear()
-    set_with_dataframe(ws, clean, include_index=False, include_column_header=True)
-    load_attendance.clear()
+    ws = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS))
+    clean = serialize_attendance(df)
+    # Row labels, so deleting those rows (e.g. a "(no date)" service) clears the block
+    unparsed = clean.index.intersection(clean.attrs.get("unparsed_dates", []))
+    if len(unparsed):
+        raise ValueError(
+            f"{len(unparsed)} ServiceDate value(s) are unreadable or ambiguous "
+            "(like 03/01/2024); change them to YYYY-MM-DD in the sheet first so rewriting it "
+            "doesn't blank or alter them."
+        )
+    write_ws(ws, clean)
+    load_sheets.clear()
 
+@retry_transient
 def save_members(df: pd.DataFrame) -> None:
-    gc = get_gspread_client()
-    sh = open_or_create_spreadsheet(gc)
-    ws = open_or_create_ws(sh, MEMBERS_WS, MEMBER_COLS)
+    ws = get_ws(MEMBERS_WS, tuple(MEMBER_COLS))
     clean = ensure_member_cols(df)
-    ws.clear()
-    set_with_dataframe(ws, clean, include_index=False, include_column_header=True)
-    load_members.clear()
+    write_ws(ws, clean)
+    load_sheets.clear()
+
+@retry_rate_limited
+def append_attendance(rows: list[dict] | pd.DataFrame) -> None:
+    """Append new check-ins to the sheet without rewriting the existing rows."""
+    if not attendance_positional_ok():
+        att = load_sheets()[0]
+        new = ensure_attendance_cols(pd.DataFrame(rows))
+        start = att.index.max() + 1 if len(att) else 0
+        merged = pd.concat([att, new.set_axis(range(start, start + len(new)))])  # labels past the loaded rows
+        merged.attrs = att.attrs  # concat drops attrs; keep unparsed_dates so the guard still applies
+        return save_attendance(merged)
+    ws = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS))
+    ws.append_rows(
+        serialize_attendance(pd.DataFrame(rows)).values.tolist(),
+        value_input_option="USER_ENTERED",
+        insert_data_option="INSERT_ROWS",
+    )
+    load_sheets.clear()
+
+@retry_rate_limited
+def append_members(rows: list[dict]) -> None:
+    """Append new roster entries without rewriting the existing members."""
+    ws = get_ws(MEMBERS_WS, tuple(MEMBER_COLS))
+    ws.append_rows(
+        ensure_member_cols(pd.DataFrame(rows)).values.tolist(),
+        value_input_option="USER_ENTERED",
+        insert_data_option="INSERT_ROWS",
+    )
+    load_sheets.clear()
+
+# Frame index idx is sheet row idx + 2 (below the header)
+def attendance_positional_ok() -> bool:
+    """False when the sheet's header isn't in ATTENDANCE_COLS order; writes then rewrite the tab."""
+    return load_sheets()[0].attrs.get("positional_ok", False)
+
+@retry_transient
+def update_attendance_row(idx: int, values: dict) -> None:
+    """Overwrite just the given cells of one attendance row."""
+    if not attendance_positional_ok():
+        att = load_sheets()[0].copy()
+        for c, v in values.items():
+            att.loc[idx, c] = v
+        return save_attendance(att)
+    ws = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS))
+    ws.batch_update(
+        [{"range": gspread.utils.rowcol_to_a1(idx + 2, ATTENDANCE_COLS.index(c) + 1), "values": [[v]]}
+         for c, v in values.items()],
+        value_input_option="USER_ENTERED",
+    )
+    load_sheets.clear()
+
+@retry_transient
+def overwrite_attendance_rows(rows: pd.DataFrame) -> None:
+    """Overwrite whole attendance rows in place; `rows` is indexed like the loaded frame."""
+    if not attendance_positional_ok():
+        att = load_sheets()[0]
+        merged = pd.concat([att.drop(index=rows.index), ensure_attendance_cols(rows)]).sort_index()
+        merged.attrs = att.attrs  # concat drops attrs; keep unparsed_dates so the guard still applies
+        return save_attendance(merged)
+    ws = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS))
+    clean = serialize_attendance(rows)
+    ws.batch_update(
+        [{"range": f"{gspread.utils.rowcol_to_a1(i + 2, 1)}:{gspread.utils.rowcol_to_a1(i + 2, len(ATTENDANCE_COLS))}",
+          "values": [vals]}
+         for i, vals in zip(clean.index, clean.values.tolist())],
+        value_input_option="USER_ENTERED",
+    )
+    load_sheets.clear()
+
+@retry_transient
+def attendance_row_matches(idx: int, row: pd.Series) -> bool:
+    """True if sheet row idx + 2 still holds the loaded row (same Timestamp and Attendee)."""
+    ws = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS))
+    # Matched by header name, so this holds whatever order the sheet's columns are in
+    header, live = [r[0] if r else [] for r in ws.batch_get(["1:1", f"{idx + 2}:{idx + 2}"])]
+    cells = dict(zip(header, live))
+    return all(
+        cells.get(c, "").strip() == ("" if pd.isna(row[c]) else str(row[c]).strip())
+        for c in ("Timestamp", "Attendee")
+    )
+
+@retry_rate_limited
+def delete_attendance_row(idx: int) -> None:
+    ws = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS))
+    ws.delete_rows(idx + 2)
+    load_sheets.clear()
 
 def ensure_absence_cols(df: pd.DataFrame) -> pd.DataFrame:
-    if df is None or df.empty:
-        df = pd.DataFrame(columns=ABSENCE_COLS)
-    for c in ABSENCE_COLS:
-        if c not in df.columns:
-            df[c] = ""
-    return df[ABSENCE_COLS].copy()
+    return (pd.DataFrame() if df is None else df).reindex(columns=ABSENCE_COLS, fill_value="")
 
-@st.cache_data(ttl=30, show_spinner=False)
-def load_absences() -> pd.DataFrame:
-    gc = get_gspread_client()
-    sh = open_or_create_spreadsheet(gc)
-    ws = open_or_create_ws(sh, ABSENCES_WS, ABSENCE_COLS)
-    df = get_as_dataframe(ws, evaluate_formulas=True, header=0, dtype=str)
+def absences_frame(rows: list[list[str]]) -> pd.DataFrame:
+    df = values_frame(rows)
     if df is None or df.empty or ("Attendee" not in df.columns):
         df = pd.DataFrame(columns=ABSENCE_COLS)
-    df = df.dropna(how="all")
-    return ensure_absence_cols(df)
+    df = ensure_absence_cols(df.dropna(how="all"))  # reindex already returns a new frame
+    # Same datetime64 ServiceDate as attendance, so lookups compare Timestamps
+    df["ServiceDate"], df.attrs["unparsed_dates"] = parse_sheet_dates(df["ServiceDate"])
+    df["ServiceDate"] = df["ServiceDate"].dt.normalize()
+    return df
+
+@retry_rate_limited
+def append_absences(rows: list[dict]) -> None:
+    """Append new absence notes without rewriting the existing ones."""
+    ws = get_ws(ABSENCES_WS, tuple(ABSENCE_COLS))
+    ws.append_rows(
+        ensure_absence_cols(pd.DataFrame(rows)).values.tolist(),
+        value_input_option="USER_ENTERED",
+        insert_data_option="INSERT_ROWS",
+    )
+    load_sheets.clear()
+
+# Writes clear this shared cache; the TTL only bounds how stale direct Sheet edits get
+@st.cache_data(ttl=600, show_spinner=False)
+@retry_transient  # a read, so safe to repeat on 429/5xx
+def load_sheets() -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Attendance, members and absences, fetched in one values.batchGet round-trip."""
+    tabs = [(ATTENDANCE_WS, ATTENDANCE_COLS), (MEMBERS_WS, MEMBER_COLS), (ABSENCES_WS, ABSENCE_COLS)]
+    for title, header in tabs:
+        get_ws(title, tuple(header))  # opens (and creates if missing) each tab
+    sh = get_ws(ATTENDANCE_WS, tuple(ATTENDANCE_COLS)).spreadsheet
+    # Formatted values (dates as written); fill_gaps pads the trimmed trailing blanks
+    ranges = sh.values_batch_get([title for title, _ in tabs])["valueRanges"]
+    rows = [gspread.utils.fill_gaps(r.get("values", [])) for r in ranges]
+    att, mem, abs_df = attendance_frame(rows[0]), members_frame(rows[1]), absences_frame(rows[2])
+    stamp = time.time_ns()  # new stamp on every re-read of the sheet
+    att.attrs["version"] = mem.attrs["version"] = stamp
+    return att, mem, abs_df
+
+# ===================== DERIVED DATA (CACHED) =====================
+# Keyed on the load stamp, so widget-only reruns reuse these
+def data_version(df: pd.DataFrame) -> int:
+    return df.attrs.get("version", 0)
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def service_totals(version: int, _att: pd.DataFrame) -> pd.DataFrame:
+    # groupby's default sort=True already orders by (ServiceDate, ServiceName)
+    return (
+        _att.groupby(["ServiceDate","ServiceName"], as_index=False, observed=True)
+            .agg(entries=("Attendee","count"), people=("Household","sum"))
+    )
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def service_options(version: int, _att: pd.DataFrame) -> dict[str, tuple]:
+    """Delete-service labels -> (ServiceDate, ServiceName), one per distinct service.
+
+    Keyed by label so a "—" inside a service name can't break the lookup. Built from
+    the rows, not service_totals, so rows with a blank date or name can be deleted too.
+    """
+    services = (
+        _att[["ServiceDate", "ServiceName"]].drop_duplicates()
+            .sort_values(["ServiceDate", "ServiceName"], na_position="last")
+    )
+    names = services["ServiceName"].astype("string")
+    labels = (services["ServiceDate"].dt.strftime("%Y-%m-%d").fillna("(no date)") + " — "
+              + names.fillna("(no name)"))
+    return dict(zip(labels, zip(services["ServiceDate"], names.astype(object).where(names.notna(), None))))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def typed_attendance(version: int, _att: pd.DataFrame) -> pd.DataFrame:
+    """Attendance rows with a usable ServiceDate, for the dashboard.
+
+    ServiceName and Attendee repeat heavily, so they become categoricals and the
+    groupbys/filters below work on integer codes. Household fits in a uint8.
+    """
+    dfc = _att.loc[_att["ServiceDate"].notna(), ["ServiceDate","ServiceName","Attendee","Household"]]
+    return dfc.assign(
+        ServiceName=dfc["ServiceName"].astype("category"),
+        Attendee=dfc["Attendee"].astype("category"),
+        Household=dfc["Household"].clip(1, 255).astype("uint8"),
+    )
+
+def group_sum(keys: np.ndarray, values: np.ndarray):
+    """Unique keys with per-key row counts and value sums, via one sort + np.add.reduceat."""
+    if len(keys) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+    order = np.argsort(keys, kind="stable")
+    k = keys[order]
+    starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+    sums = np.add.reduceat(values[order].astype(np.int64), starts)
+    counts = np.diff(np.r_[starts, len(k)])
+    return k[starts], counts, sums
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean with a NaN warm-up, like Series.rolling(window).mean(), from one cumsum."""
+    cs = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    out = np.full(len(values), np.nan)
+    if window <= len(values):
+        out[window - 1:] = (cs[window:] - cs[:-window]) / window
+    return out
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def dashboard_aggregates(version: int, _dfc: pd.DataFrame, start, end, svc_pick: str):
+    """Daily totals, per-service mix and top attendees for the chosen filters.
+
+    Returns None when the filters leave no rows.
+    """
+    # Both filters go into one NumPy mask, so there is a single take instead of a frame per filter
+    keep = np.ones(len(_dfc), dtype=bool)
+    if start is not None:
+        # ServiceDate is normalized datetime64, so this is a plain int64 range check
+        day = _dfc["ServiceDate"].to_numpy()
+        keep &= (day >= np.datetime64(start)) & (day <= np.datetime64(end))
+    if svc_pick != "All":
+        keep &= (_dfc["ServiceName"] == svc_pick).to_numpy()
+    if not keep.any():
+        return None
+    dfc = _dfc if keep.all() else _dfc[keep]
+
+    day = dfc["ServiceDate"].to_numpy("datetime64[D]").astype(np.int64)
+    household = dfc["Household"].to_numpy()
+
+    # Daily totals over every row, including ones with a blank ServiceName
+    keys, entries, people = group_sum(day, household)
+    daily = pd.DataFrame({
+        "Date":    pd.to_datetime(keys, unit="D"),
+        "people":  people,
+        "entries": entries,
+    })
+
+    # (day, service) packed into one int key so the rollup is a single sort + reduceat
+    cats = dfc["ServiceName"].cat.categories
+    ncat = max(len(cats), 1)
+    svc = dfc["ServiceName"].cat.codes.to_numpy(np.int64)
+    keep = svc >= 0
+    keys, entries, people = group_sum(day[keep] * ncat + svc[keep], household[keep])
+    svc_mix = pd.DataFrame({
+        "Date":        pd.to_datetime(keys // ncat, unit="D"),
+        "ServiceName": cats[keys % ncat],
+        "people":      people,
+        "entries":     entries,
+    })
+
+    codes = dfc["Attendee"].cat.codes.to_numpy(np.int64)
+    named = codes >= 0
+    keys, times, people = group_sum(codes[named], household[named])
+    topn = pd.DataFrame({
+        "Attendee": dfc["Attendee"].cat.categories[keys],
+        "times":    times,
+        "people":   people,
+    }).nlargest(20, "people")
+
+    # Only what the charts encode; plain strings so the full category lists aren't shipped
+    svc_mix = svc_mix[["Date","ServiceName","people"]].astype({"ServiceName": str})
+    topn = topn[["Attendee","times","people"]].astype({"Attendee": str})
+    return daily, svc_mix, topn
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def log_search_keys(version: int, _att: pd.DataFrame) -> pd.DataFrame:
+    """Lower-cased ServiceName/Attendee, so the log filters are plain substring scans.
+
+    Arrow-backed strings make str.contains run pyarrow's match_substring kernel.
+    """
+    return pd.DataFrame({
+        "ServiceName": _att["ServiceName"].astype("string[pyarrow]").fillna("").str.lower(),
+        "Attendee":    _att["Attendee"].astype("string[pyarrow]").fillna("").str.lower(),
+    }, index=_att.index)
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def member_name_keys(version: int, _mem: pd.DataFrame) -> frozenset[str]:
+    """Lower-cased roster names, for O(1) "already on the roster?" checks."""
+    return frozenset(_mem["Attendee"].dropna().astype(str).str.strip().str.lower())
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def active_roster(version: int, _mem: pd.DataFrame) -> pd.Series:
+    """Sorted, de-duplicated names of active members (Arrow strings)."""
+    names = _mem.loc[_mem["Active"] == 1, "Attendee"].dropna().astype("string[pyarrow]").str.strip()
+    return pd.Series(names.unique(), dtype="string[pyarrow]").sort_values(ignore_index=True)
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def attendance_csv(version: int, _att: pd.DataFrame) -> bytes:
+    return serialize_attendance(_att).to_csv(index=False).encode("utf-8")
+
+@st.cache_data(max_entries=2, show_spinner=False)
+def members_csv(version: int, _mem: pd.DataFrame) -> bytes:
+    return _mem.to_csv(index=False).encode("utf-8")
 
-def save_absences(df: pd.DataFrame) -> None:
-    gc = get_gspread_client()
-    sh = open_or_create_spreadsheet(gc)
-    ws = open_or_create_ws(sh, ABSENCES_WS, ABSENCE_COLS)
-    clean = ensure_absence_cols(df)
-    ws.clear()
-    set_with_dataframe(ws, clean, include_index=False, include_column_header=True)
-    load_absences.clear()
-    
 # ============================ UI STATE ==========================
 if "is_admin" not in st.session_state:
     st.session_state.is_admin = False
 
 st.title("Mansfield PIWC Attendance")
 
+# Load persistent data
+att, mem, abs_df = load_sheets()
+att_version = data_version(att)
+mem_version = data_version(mem)
+
 with st.sidebar:
     # ---------- Service ----------
     st.header("Service")
 
     svc_date = st.date_input("Service date", value=date.today(), key="svc_date")
 
-    _att_for_sidebar = load_attendance()  # cached; fast
     existing_services = sorted(
-        _att_for_sidebar.loc[
-            _att_for_sidebar["ServiceDate"] == svc_date.isoformat(),
+        att.loc[
+            att["ServiceDate"] == pd.Timestamp(svc_date),
             "ServiceName"
         ].dropna().unique().tolist()
     )
@@ -203,11 +573,6 @@ with st.sidebar:
         if st.button("Lock admin"):
             st.session_state.is_admin = False
 
-# Load persistent data
-att = load_attendance()
-mem = load_members()
-abs_df = load_absences()
-
 # ===================== ADD ATTENDEE (WITH ROSTER) =====================
 st.subheader("Add attendee")
 
@@ -223,12 +588,7 @@ notes_in = st.text_input("Notes (e.g., Title, visitor, etc.)", value="", key="no
 
 if mode == "From roster":
     # Use active members first; the selectbox is searchable when the list is long
-    active_mem = mem[mem["Active"] == 1].copy()
-    options = (
-        active_mem["Attendee"]
-        .dropna().astype(str).str.strip()
-        .sort_values().unique().tolist()
-    )
+    options = active_roster(mem_version, mem).tolist()
     selected = col1.selectbox(
         "Search member (type to filter)",
         options,
@@ -242,7 +602,7 @@ if mode == "From roster":
     with col2:
         st.write("")  # spacer
         if selected:
-            mrow = active_mem[active_mem["Attendee"] == selected].iloc[0]
+            mrow = mem[(mem["Attendee"] == selected) & (mem["Active"] == 1)].iloc[0]
             st.success(f"Selected: {mrow['FirstName']} {mrow['LastName']}")
         else:
             st.info("Tip: If a person isn’t listed, switch to **Manual entry** and you can add them to the roster.")
@@ -259,24 +619,17 @@ if mode == "From roster":
                 "Household":   int(hh_single),
                 "Notes":       notes_in,
             }
-            att = pd.concat([att, pd.DataFrame([new])], ignore_index=True)
-            save_attendance(att)
-            st.success(f"Checked in: {selected} (Household {int(hh_single)})")
-            time.sleep(0.1)
+            append_attendance([new])
+            st.toast(f"Checked in: {selected} (Household {int(hh_single)})")
             st.rerun()
 
 elif mode == "Batch from roster":
     # Build roster of active members
-    active_mem = mem[mem["Active"] == 1].copy()
-    roster_all = (
-        active_mem["Attendee"]
-        .dropna().astype(str).str.strip()
-        .sort_values().unique().tolist()
-    )
+    roster_all = active_roster(mem_version, mem)
 
     # Already-present for this service/date → pre-select them
     present_today = (
-        att[(att["ServiceDate"] == svc_date.isoformat()) &
+        att[(att["ServiceDate"] == pd.Timestamp(svc_date)) &
             (att["ServiceName"] == svc_name.strip())]["Attendee"]
           .dropna().astype(str).str.strip().unique().tolist()
     )
@@ -284,7 +637,9 @@ elif mode == "Batch from roster":
 
     # Optional quick filter
     q = st.text_input("Filter roster (optional)", placeholder="Type to filter names…", key="batch_filter")
-    roster = [n for n in roster_all if q.lower() in n.lower()] if q else roster_all
+    roster = (
+        roster_all[roster_all.str.contains(q, case=False, regex=False)] if q else roster_all
+    ).tolist()
 
     if not roster:
         st.info("No matching names. Clear the filter or add members to the roster.")
@@ -311,43 +666,48 @@ elif mode == "Batch from roster":
             },
         )
 
-        chosen = edited[edited["Select"]].copy()
+        chosen = edited[edited["Select"]]
 
         # Add/update attendees in one go
         add_label = f"Save {len(chosen)} present attendee(s)" if len(chosen) else "Save selected attendee(s)"
         if st.button(add_label, use_container_width=True, key="btn_add_batch"):
             ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-            def to_int(x):
-                try:
-                    v = int(float(x));  return v if v > 0 else 1
-                except Exception:
-                    return 1
-
             # Remove any existing rows for this service/date for the selected people (to avoid duplicates),
             # then re-add what is in the editor now.
             if not chosen.empty:
                 chosen_names = chosen["Attendee"].astype(str).str.strip().tolist()
                 is_same_service = (
-                    (att["ServiceDate"] == svc_date.isoformat()) &
+                    (att["ServiceDate"] == pd.Timestamp(svc_date)) &
                     (att["ServiceName"] == svc_name.strip()) &
                     (att["Attendee"].isin(chosen_names))
                 )
-                att = att.loc[~is_same_service].reset_index(drop=True)
 
-                new_rows = [{
+                new_rows = pd.DataFrame({
                     "Timestamp":  ts,
-                    "ServiceDate": svc_date.isoformat(),
+                    "ServiceDate": pd.Timestamp(svc_date),
                     "ServiceName": svc_name.strip(),
-                    "Attendee":    r["Attendee"],
-                    "Household":   to_int(r["Household"]),
-                    "Notes":       str(r.get("Notes", "")).strip(),
-                } for _, r in chosen.iterrows()]
-
-                att = pd.concat([att, pd.DataFrame(new_rows)], ignore_index=True)
-                save_attendance(att)
-                st.success(f"Saved {len(new_rows)} attendee(s) for {svc_name} on {svc_date.isoformat()}.")
-                time.sleep(0.1); st.rerun()
+                    "Attendee":    chosen["Attendee"].to_numpy(),
+                    "Household":   pd.to_numeric(chosen["Household"], errors="coerce")
+                                     .fillna(1).astype(int).clip(lower=1).to_numpy(),
+                    "Notes":       chosen["Notes"].fillna("").astype(str).str.strip().to_numpy(),
+                })
+
+                # Overwrite each person's first row; delete extra duplicates bottom-up
+                existing = att.loc[is_same_service, "Attendee"].astype(str).str.strip()
+                keep = existing[~existing.duplicated()]
+                row_of = dict(zip(keep.values, keep.index))
+                hit = new_rows["Attendee"].isin(list(row_of))
+                if hit.any():
+                    overwrite_attendance_rows(
+                        new_rows[hit].set_axis(new_rows.loc[hit, "Attendee"].map(row_of).to_numpy())
+                    )
+                for idx in sorted(existing.index.difference(keep.index), reverse=True):
+                    delete_attendance_row(idx)
+                if not hit.all():
+                    append_attendance(new_rows[~hit])
+                st.toast(f"Saved {len(new_rows)} attendee(s) for {svc_name} on {svc_date.isoformat()}.")
+                st.rerun()
             else:
                 st.warning("Select at least one person in the list.")
 
@@ -378,51 +738,38 @@ elif mode == "Manual entry":
                 "Household":   int(hh),
                 "Notes":       notes_in,
             }
-            att = pd.concat([att, pd.DataFrame([new])], ignore_index=True)
-            save_attendance(att)
+            append_attendance([new])
 
             if add_to_roster:
                 # Only add if not already present (case-insensitive)
-                exists = (mem["Attendee"].str.lower() == full.lower()).any()
-                if not exists:
-                    mem = pd.concat(
-                        [mem, pd.DataFrame([{
-                            "FirstName": first, "LastName": last,
-                            "Attendee": full, "Notes": "", "Active": 1
-                        }])],
-                        ignore_index=True
-                    )
-                    save_members(mem)
+                if full.lower() not in member_name_keys(mem_version, mem):
+                    append_members([{
+                        "FirstName": first, "LastName": last,
+                        "Attendee": full, "Notes": "", "Active": 1
+                    }])
 
-            st.success(f"Checked in: {full} (Household {int(hh)})")
-            time.sleep(0.1)
+            st.toast(f"Checked in: {full} (Household {int(hh)})")
             st.rerun()
             
 # ============================ SUMMARY =============================
 st.markdown("### Summary")
-att = ensure_attendance_cols(att)
-sel_date = svc_date.isoformat()
+sel_date = pd.Timestamp(svc_date)
 mask = (att["ServiceDate"] == sel_date) & ((att["ServiceName"] == svc_name.strip()) if svc_name.strip() else True)
-att_today = att[mask].copy()
+att_today = att[mask]
 
 if att.empty:
     st.info("No records yet. Add an attendee or import a CSV.")
 else:
     total_entries = len(att_today)
-    total_people  = int(pd.to_numeric(att_today["Household"], errors="coerce").fillna(1).sum()) if not att_today.empty else 0
+    total_people  = int(att_today["Household"].sum())
     c1, c2, c3 = st.columns(3)
     c1.metric("Entries (selected service)", total_entries)
     c2.metric("People (selected service)", total_people)
     c3.metric("All-time records", len(att))
 
     st.markdown("#### Totals per Service")
-    summary = (
-        att.assign(Household=pd.to_numeric(att["Household"], errors="coerce").fillna(1).astype(int))
-           .groupby(["ServiceDate","ServiceName"], as_index=False)
-           .agg(entries=("Attendee","count"), people=("Household","sum"))
-           .sort_values(["ServiceDate","ServiceName"])
-    )
-    st.dataframe(summary, use_container_width=True)
+    summary = service_totals(att_version, att)
+    st.dataframe(summary, use_container_width=True, column_config=DATE_COLUMN_CONFIG)
 
 # ====================== ABSENTEES & REASONS (ADMIN) ======================
 st.markdown("### Absentees & Reasons (Admin)")
@@ -431,10 +778,7 @@ if not st.session_state.is_admin:
     st.info("Unlock Admin mode in the sidebar to manage absentees.")
 else:
     # Active roster (Attendee names) vs attendees for the selected service/date
-    active_attendees = (
-        mem[mem["Active"] == 1]["Attendee"]
-        .dropna().astype(str).str.strip().unique().tolist()
-    )
+    active_attendees = active_roster(mem_version, mem).tolist()
 
     present_today = (
         att_today["Attendee"].dropna().astype(str).str.strip().unique().tolist()
@@ -453,107 +797,117 @@ else:
             f"**Absent:** {len(missing)}"
         )
 
-    if st.button("Find absentees for this service"):
+    # A toggle (not a button) so the editor survives the reruns its own edits cause
+    if st.toggle("Find absentees for this service", key="show_absentees"):
         if not missing:
             st.success("No absentees — everyone on the active roster attended 🎉")
         else:
             st.info("Enter a note for any absent member (e.g., traveling, unwell, work). Leave blank to skip.")
-            notes_inputs = {}
-            for name in missing:
-                key = f"abs_note__{svc_date.isoformat()}__{svc_name.strip()}__{name}"
-                notes_inputs[name] = st.text_input(f"Reason / note — {name}", key=key)
+            # One editor per service: drop the edit state left behind by other services
+            editor_key = f"abs_editor__{svc_date.isoformat()}__{svc_name.strip()}"
+            for k in [k for k in st.session_state if str(k).startswith("abs_editor__") and k != editor_key]:
+                del st.session_state[k]
+            edited_abs = st.data_editor(
+                pd.DataFrame({"Attendee": missing, "Note": ""}),
+                use_container_width=True,
+                hide_index=True,
+                num_rows="fixed",
+                key=editor_key,
+                column_config={
+                    "Attendee": st.column_config.TextColumn("Attendee", disabled=True),
+                    "Note": st.column_config.TextColumn("Reason / note"),
+                },
+            )
 
             if st.button("Save absence notes"):
-                current_abs = load_absences()
-                new_rows = []
-                ts_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                for name, note in notes_inputs.items():
-                    note = (note or "").strip()
-                    if note:
-                        new_rows.append({
-                            "Timestamp":  ts_now,
-                            "ServiceDate": svc_date.isoformat(),
-                            "ServiceName": svc_name.strip(),
-                            "Attendee":    name,
-                            "Note":        note,
-                        })
-                if new_rows:
-                    updated = pd.concat([current_abs, pd.DataFrame(new_rows)], ignore_index=True)
-                    save_absences(updated)
-                    st.success(f"Saved {len(new_rows)} absence note(s).")
-                    time.sleep(0.1); st.rerun()
+                notes = edited_abs["Note"].fillna("").astype(str).str.strip()
+                has_note = notes != ""
+                if has_note.any():
+                    ts_now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    new_rows = [{
+                        "Timestamp":  ts_now,
+                        "ServiceDate": svc_date.isoformat(),
+                        "ServiceName": svc_name.strip(),
+                        "Attendee":    name,
+                        "Note":        note,
+                    } for name, note in zip(edited_abs.loc[has_note, "Attendee"], notes[has_note])]
+                    append_absences(new_rows)
+                    del st.session_state[editor_key]  # start blank, so a second click can't re-append
+                    st.toast(f"Saved {len(new_rows)} absence note(s).")
+                    st.rerun()
                 else:
                     st.warning("No notes entered — nothing to save.")
 
     # Show saved notes for this service/date
     svc_abs = abs_df[
-        (abs_df["ServiceDate"] == svc_date.isoformat()) &
+        (abs_df["ServiceDate"] == sel_date) &
         ((abs_df["ServiceName"] == svc_name.strip()) if svc_name.strip() else True)
-    ].copy()
+    ]
 
     if not svc_abs.empty:
         st.markdown("#### Notes saved for this service")
-        st.dataframe(svc_abs.sort_values("Attendee"), use_container_width=True)
+        st.dataframe(svc_abs.sort_values("Attendee"), use_container_width=True,
+                     column_config=DATE_COLUMN_CONFIG)
     else:
         st.caption("No saved absence notes for the selected service yet.")
         
 # =========================== DASHBOARD ===========================
-st.markdown("## 📊 Dashboard")
-if att.empty:
-    st.info("No data to chart yet.")
-else:
-    dfc = att.copy()
-    dfc["ServiceDate"] = pd.to_datetime(dfc["ServiceDate"], errors="coerce")
-    dfc = dfc.dropna(subset=["ServiceDate"])
-    dfc["Household"] = pd.to_numeric(dfc["Household"], errors="coerce").fillna(1).astype(int)
+@st.fragment
+def render_dashboard(att: pd.DataFrame, version: int) -> None:
+    """Dashboard widgets rerun only this fragment, not the whole page."""
+    st.markdown("## 📊 Dashboard")
+    if att.empty:
+        st.info("No data to chart yet.")
+        return
+
+    dfc = typed_attendance(version, att)
 
     fc1, fc2, fc3 = st.columns([2,2,2])
     with fc1:
         dmin, dmax = (dfc["ServiceDate"].min().date(), dfc["ServiceDate"].max().date()) if not dfc.empty else (date.today(), date.today())
         dr = st.date_input("Date range", value=(dmin, dmax))
     with fc2:
-        svc_opts = ["All"] + sorted(dfc["ServiceName"].dropna().unique().tolist())
+        svc_opts = ["All"] + list(dfc["ServiceName"].cat.categories)
         svc_pick = st.selectbox("Service", svc_opts, index=0)
     with fc3:
         roll = st.slider("Rolling mean (days)", 1, 8, 3)
 
-    if isinstance(dr, tuple) and len(dr) == 2:
-        dfc = dfc[(dfc["ServiceDate"].dt.date >= dr[0]) & (dfc["ServiceDate"].dt.date <= dr[1])]
-    if svc_pick != "All":
-        dfc = dfc[dfc["ServiceName"] == svc_pick]
+    start, end = dr if isinstance(dr, tuple) and len(dr) == 2 else (None, None)
+    aggregates = dashboard_aggregates(version, dfc, start, end, svc_pick)
+    if aggregates is None:
+        st.info("No attendance matches the selected filters.")
+        return
 
-    dfc = dfc.copy()
-    dfc["Date"] = dfc["ServiceDate"].dt.date
-    daily = dfc.groupby("Date", as_index=False).agg(people=("Household","sum"), entries=("Attendee","count"))
+    daily, svc_mix, topn = aggregates
     if not daily.empty:
-        daily["Date"] = pd.to_datetime(daily["Date"])
-        daily["roll"] = daily["people"].rolling(roll).mean()
-        line1 = alt.Chart(daily).mark_line().encode(x="Date:T", y=alt.Y("people:Q", title="People"), tooltip=["Date:T","people"])
-        line2 = alt.Chart(daily).mark_line(strokeDash=[6,3]).encode(x="Date:T", y="roll:Q", tooltip=["Date:T","roll"])
-        st.altair_chart((line1+line2).properties(height=320).interactive(), use_container_width=True)
+        daily["roll"] = rolling_mean(daily["people"].to_numpy(), roll)
+        st.vega_lite_chart(daily[["Date","people","roll"]], DAILY_SPEC, use_container_width=True)
 
-    svc_mix = dfc.groupby(["Date","ServiceName"], as_index=False).agg(people=("Household","sum"))
     if not svc_mix.empty:
-        svc_mix["Date"] = pd.to_datetime(svc_mix["Date"])
-        area = alt.Chart(svc_mix).mark_area().encode(x="Date:T", y="people:Q", color="ServiceName:N", tooltip=["Date:T","ServiceName","people"])
-        st.altair_chart(area.properties(height=260).interactive(), use_container_width=True)
+        st.vega_lite_chart(svc_mix, SVC_MIX_SPEC, use_container_width=True)
 
-    topn = (dfc.groupby("Attendee", as_index=False)
-              .agg(times=("Attendee","count"), people=("Household","sum"))
-              .sort_values("people", ascending=False).head(20))
     if not topn.empty:
-        bars = alt.Chart(topn).mark_bar().encode(
-            x=alt.X("people:Q", title="People (incl. household)"),
-            y=alt.Y("Attendee:N", sort="-x", title=None),
-            tooltip=["Attendee","times","people"],
-        )
-        st.altair_chart(bars.properties(height=28*len(topn)+40), use_container_width=True)
+        st.vega_lite_chart(topn, {**TOPN_SPEC, "height": 28*len(topn)+40}, use_container_width=True)
+
+render_dashboard(att, att_version)
 
 # =========================== LOG / EDIT ==========================
-st.markdown("### Attendance Log")
-if att.empty:
-    st.write("—")
-else:
+def reload_stale_log() -> None:
+    """The sheet moved under the loaded frame: refuse the write and reload."""
+    load_sheets.clear()
+    st.toast("That row changed in the sheet since it was loaded — reloaded, please check and retry.")
+    st.rerun()
+
+@st.fragment
+def render_log() -> None:
+    """Log filters rerun only this fragment; admin edits still rerun the app."""
+    att, _, _ = load_sheets()  # fragment reruns skip the script body, so re-read here (cache hit)
+    version = data_version(att)
+    st.markdown("### Attendance Log")
+    if att.empty:
+        st.write("—")
+        return
+
     f1, f2, f3 = st.columns(3)
     with f1:
         f_date = st.date_input("Filter by date", value=None, key="log_date")
@@ -562,108 +916,120 @@ else:
     with f3:
         f_name = st.text_input("Filter attendee name contains", key="log_name")
 
-    log = att.copy()
-    if f_date:
-        log = log[log["ServiceDate"] == f_date.isoformat()]
-    if f_svc:
-        log = log[log["ServiceName"].str.contains(f_svc, case=False, na=False)]
-    if f_name:
-        log = log[log["Attendee"].str.contains(f_name, case=False, na=False)]
-
-    st.dataframe(log, use_container_width=True)
+    f_svc, f_name = f_svc.strip().lower(), f_name.strip().lower()
+    log = att
+    if f_date or f_svc or f_name:
+        mask = pd.Series(True, index=att.index)
+        if f_date:
+            mask &= att["ServiceDate"] == pd.Timestamp(f_date)
+        if f_svc or f_name:
+            keys = log_search_keys(version, att)
+            if f_svc:
+                mask &= keys["ServiceName"].str.contains(f_svc, regex=False)
+            if f_name:
+                mask &= keys["Attendee"].str.contains(f_name, regex=False)
+        log = att[mask]
+
+    st.dataframe(log, use_container_width=True, column_config=DATE_COLUMN_CONFIG)
 
     if st.session_state.is_admin and not log.empty:
         st.markdown("#### Edit / Delete (Admin)")
         idx = st.number_input("Row index to edit/delete",
-                              min_value=0, max_value=len(att) - 1, step=1, value=0)
+                              min_value=0, max_value=int(att.index.max()), step=1, value=0)
+        if idx not in att.index:
+            st.warning("No row with that index.")
+            return
         cA, cB, cC, cD = st.columns(4)
         with cA:
-            new_name = st.text_input("New name", value=att.loc[idx, "Attendee"])
+            new_name = st.text_input("New name", value=att.loc[idx, "Attendee"] if pd.notna(att.loc[idx, "Attendee"]) else "")
         with cB:
             new_house = st.text_input("New household", value=str(att.loc[idx, "Household"]))
         with cC:
-            new_notes = st.text_input("New notes", value=att.loc[idx, "Notes"])
+            new_notes = st.text_input("New notes", value=att.loc[idx, "Notes"] if pd.notna(att.loc[idx, "Notes"]) else "")
         with cD:
             if st.button("Apply edit"):
+                if not attendance_row_matches(idx, att.loc[idx]):
+                    reload_stale_log()
                 def to_int(x):
                     try:
                         v = int(float(x));  return v if v > 0 else 1
                     except:
                         return 1
-                att.loc[idx, "Attendee"]  = new_name.strip()
-                att.loc[idx, "Household"] = to_int(new_house)
-                att.loc[idx, "Notes"]     = new_notes
-                save_attendance(att)
-                st.success("Row updated.")
-                time.sleep(0.1); st.rerun()
+                update_attendance_row(idx, {
+                    "Attendee":  new_name.strip(),
+                    "Household": to_int(new_house),
+                    "Notes":     new_notes,
+                })
+                st.toast("Row updated.")
+                st.rerun()
 
         if st.button("Delete row"):
-            att = att.drop(index=idx).reset_index(drop=True)
-            save_attendance(att)
-            st.success("Row deleted.")
-            time.sleep(0.1); st.rerun()
+            if not attendance_row_matches(idx, att.loc[idx]):
+                reload_stale_log()
+            delete_attendance_row(idx)
+            st.toast("Row deleted.")
+            st.rerun()
+
+render_log()
 
 # ======================= IMPORT / EXPORT (SIDEBAR) =========================
 with st.sidebar:
     if st.session_state.is_admin:
         st.markdown("### 📂 Data Export / Import")
 
-        csv_att = ensure_attendance_cols(att).to_csv(index=False).encode("utf-8")
-        st.download_button("⬇️ Download attendance CSV", data=csv_att,
+        # Callable data: the CSV is only built when a download is clicked
+        st.download_button("⬇️ Download attendance CSV", data=lambda: attendance_csv(att_version, att),
                            file_name="attendance_export.csv", mime="text/csv")
 
         st.markdown("**Import attendance CSV**")
         up = st.file_uploader("Upload attendance CSV",
                               type=["csv"], key="up_att", label_visibility="collapsed")
-        if up is not None:
+        # The uploader keeps its file across reruns: import each upload only once
+        if up is not None and st.session_state.get("imported_att") != up.file_id:
             try:
-                newdf = pd.read_csv(up)
+                newdf = pd.read_csv(up, dtype=str, engine="pyarrow")
                 missing = [c for c in ATTENDANCE_COLS if c not in newdf.columns]
                 if missing:
                     st.error(f"CSV must include: {', '.join(ATTENDANCE_COLS)}. Missing: {', '.join(missing)}")
                 else:
-                    save_attendance(newdf[ATTENDANCE_COLS].copy())
-                    st.success("Imported attendance and saved to Google Sheets.")
-                    time.sleep(0.1); st.rerun()
+                    save_attendance(newdf[ATTENDANCE_COLS])
+                    st.session_state.imported_att = up.file_id
+                    st.toast("Imported attendance and saved to Google Sheets.")
+                    st.rerun()
             except Exception as e:
                 st.error(f"Import failed: {e}")
 
         st.markdown("---")
         st.markdown("**Members roster**")
 
-        csv_mem = ensure_member_cols(mem).to_csv(index=False).encode("utf-8")
-        st.download_button("⬇️ Download roster CSV", data=csv_mem,
+        st.download_button("⬇️ Download roster CSV", data=lambda: members_csv(mem_version, mem),
                            file_name="members_export.csv", mime="text/csv")
 
         upm = st.file_uploader("Upload roster CSV",
                                type=["csv"], key="up_mem", label_visibility="collapsed")
-        if upm is not None:
+        if upm is not None and st.session_state.get("imported_mem") != upm.file_id:
             try:
-                mdf = pd.read_csv(upm, dtype=str)
+                mdf = pd.read_csv(upm, dtype=str, engine="pyarrow")
                 # Flexible: accept Attendee or First/Last; normalize
                 if "Attendee" in mdf.columns and ("FirstName" not in mdf.columns or "LastName" not in mdf.columns):
                     split = mdf["Attendee"].fillna("").astype(str).str.strip().str.split(" ", n=1, expand=True)
                     mdf["FirstName"] = split[0].fillna("")
                     mdf["LastName"]  = split[1].fillna("")
-                mdf["Active"] = pd.to_numeric(mdf.get("Active", 1), errors="coerce").fillna(1).astype(int)
-                mdf["Notes"]  = mdf.get("Notes", "")
-                mdf = ensure_member_cols(mdf)
-                save_members(mdf)
-                st.success("Roster imported.")
-                time.sleep(0.1); st.rerun()
+                save_members(mdf)  # fills Notes/Active and normalizes in one pass
+                st.session_state.imported_mem = upm.file_id
+                st.toast("Roster imported.")
+                st.rerun()
             except Exception as e:
                 st.error(f"Roster import failed: {e}")
 
         st.markdown("---")
         with st.expander("Export absences (optional)"):
-            abs_all = load_absences()
-            if abs_all.empty:
+            if abs_df.empty:
                 st.caption("No absences saved yet.")
             else:
-                csv_abs = abs_all.to_csv(index=False).encode("utf-8")
                 st.download_button(
                     "⬇️ Download absences CSV",
-                    data=csv_abs,
+                    data=lambda: abs_df.to_csv(index=False).encode("utf-8"),
                     file_name="absences_export.csv",
                     mime="text/csv",
                 )
@@ -673,22 +1039,13 @@ if st.session_state.is_admin and not att.empty:
     st.sidebar.markdown("---")
     st.sidebar.header("🗑️ Delete Service Records")
 
-    # Build list of unique services (date + name)
-    service_list = (
-        att[["ServiceDate", "ServiceName"]]
-        .drop_duplicates()
-        .sort_values(["ServiceDate", "ServiceName"])
-    )
+    options_map = service_options(att_version, att)
 
-    if not service_list.empty:
-        options = [
-            f"{r.ServiceDate} — {r.ServiceName}"
-            for r in service_list.itertuples(index=False)
-        ]
+    if options_map:
 
         sel_service = st.sidebar.selectbox(
             "Select service to delete",
-            ["--"] + options,
+            ["--"] + list(options_map),
             index=0,
             help="This will remove ALL rows that match the selected date + service.",
         )
@@ -700,15 +1057,18 @@ if st.session_state.is_admin and not att.empty:
         )
 
         if sel_service != "--" and confirm and st.sidebar.button("Delete selected service"):
-            sdate, sname = sel_service.split(" — ", 1)
+            sdate, sname = options_map[sel_service]
+            same_date = att["ServiceDate"].isna() if pd.isna(sdate) else att["ServiceDate"] == sdate
+            same_name = att["ServiceName"].isna() if sname is None else att["ServiceName"] == sname
             before = len(att)
-            att = att[
-                ~((att["ServiceDate"] == sdate) & (att["ServiceName"] == sname))
-            ].reset_index(drop=True)
-            save_attendance(att)
-            st.sidebar.success(f"Deleted {before - len(att)} rows for {sdate} — {sname}")
-            time.sleep(0.1)
-            st.rerun()
+            att = att[~(same_date & same_name)]  # keep row labels for the unparsed_dates check
+            try:
+                save_attendance(att)
+            except ValueError as e:
+                st.sidebar.error(f"Delete failed: {e}")
+            else:
+                st.toast(f"Deleted {before - len(att)} rows for {sel_service}")
+                st.rerun()
     else:
         st.sidebar.info("No services found to delete.")
 